@@ -128,7 +128,7 @@ void array::wait() {
 void array::eval() {
   // Ensure the array is ready to be read
   if (status() == Status::unscheduled) {
-    mlx::core::eval({*this});
+    detail::eval_values({*this});
   } else {
     wait();
   }
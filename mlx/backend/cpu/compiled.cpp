@@ -1,10 +1,12 @@
 // Copyright © 2023-2024 Apple Inc.
 
 #include <dlfcn.h>
+#include <cstdlib>
 #include <filesystem>
 #include <fstream>
 #include <list>
 #include <mutex>
+#include <random>
 #include <shared_mutex>
 
 #include <fmt/format.h>
@@ -45,6 +47,24 @@ static CompilerCache& cache() {
   return cache_;
 };
 
+// Get the directory for storing the compiled shared libraries. Setting
+// MLX_COMPILE_CACHE_DIR keeps the libraries in a persistent location so they
+// can be reused across processes.
+static const std::filesystem::path& compile_cache_dir() {
+  static std::filesystem::path cache_dir = []() -> std::filesystem::path {
+    if (auto c = std::getenv("MLX_COMPILE_CACHE_DIR"); c) {
+      std::filesystem::path dir = c;
+      std::error_code error;
+      if (std::filesystem::exists(dir, error) ||
+          std::filesystem::create_directories(dir, error)) {
+        return dir;
+      }
+    }
+    return std::filesystem::temp_directory_path();
+  }();
+  return cache_dir;
+}
+
 // GPU compile is always available if the GPU is available and since we are in
 // this file CPU compile is also available.
 namespace detail {
@@ -78,50 +98,76 @@ void* compile(
   // characters, and on Windows the maximum length for whole path is 260. Clip
   // file name with a little extra room and append a 16 character hash.
 #ifdef _WIN32
-  constexpr int max_file_name_length = 140;
+  constexpr int max_file_name_length = 123;
 #else
-  constexpr int max_file_name_length = 245;
+  constexpr int max_file_name_length = 228;
 #endif
+  std::ostringstream file_name;
   if (kernel_name.size() > max_file_name_length) {
-    std::ostringstream file_name;
     file_name
         << std::string_view(kernel_name).substr(0, max_file_name_length - 16);
     auto file_id =
         std::hash<std::string>{}(kernel_name.substr(max_file_name_length - 16));
     file_name << "_" << std::hex << std::setw(16) << file_id << std::dec;
-    kernel_file_name = file_name.str();
   } else {
-    kernel_file_name = kernel_name;
+    file_name << kernel_name;
   }
 
-  auto output_dir = std::filesystem::temp_directory_path();
+  // The kernel name does not capture everything in the source, e.g. the
+  // preamble of a different MLX version, so also name the files by a hash of
+  // the source to not reuse a stale library from a persistent cache directory
+  file_name << "_" << std::hex << std::setfill('0') << std::setw(16)
+            << std::hash<std::string>{}(source_code) << std::dec;
+  kernel_file_name = file_name.str();
+
+  auto& output_dir = compile_cache_dir();
 
   std::string shared_lib_name = "lib" + kernel_file_name + ".so";
   auto shared_lib_path = (output_dir / shared_lib_name).string();
-  bool lib_exists = false;
-  {
-    std::ifstream f(shared_lib_path.c_str());
-    lib_exists = f.good();
-  }
+  if (!std::filesystem::exists(shared_lib_path)) {
+    // Build under names unique to this call and move the library into place
+    // once it is complete, so processes sharing the cache directory neither
+    // write the same files nor load a partially written library
+    auto tmp_file_name =
+        fmt::format("{0}_{1:08x}", kernel_file_name, std::random_device{}());
+    std::string source_file_name = tmp_file_name + ".cpp";
+    std::string tmp_lib_name = "lib" + tmp_file_name + ".so";
+    auto source_file_path = output_dir / source_file_name;
+    auto tmp_lib_path = output_dir / tmp_lib_name;
 
-  if (!lib_exists) {
     // Open source file and write source code to it
-    std::string source_file_name = kernel_file_name + ".cpp";
-    auto source_file_path = (output_dir / source_file_name).string();
-
     std::ofstream source_file(source_file_path);
     source_file << source_code;
     source_file.close();
 
+    std::error_code ec;
     try {
       JitCompiler::exec(JitCompiler::build_command(
-          output_dir, source_file_name, shared_lib_name));
+          output_dir, source_file_name, tmp_lib_name));
     } catch (const std::exception& error) {
+      std::filesystem::remove(source_file_path, ec);
       throw std::runtime_error(fmt::format(
           "[Compile::eval_cpu] Failed to compile function {0}: {1}",
           kernel_name,
           error.what()));
     }
+
+    // Another process may have finished the same library first, in which case
+    // the rename either replaces it with an identical one or fails when it is
+    // in use and the existing library is loaded instead
+    std::filesystem::rename(
+        source_file_path, output_dir / (kernel_file_name + ".cpp"), ec);
+    std::filesystem::rename(tmp_lib_path, shared_lib_path, ec);
+    if (ec) {
+      std::error_code remove_ec;
+      std::filesystem::remove(tmp_lib_path, remove_ec);
+      if (!std::filesystem::exists(shared_lib_path)) {
+        throw std::runtime_error(fmt::format(
+            "[Compile::eval_cpu] Failed to cache function {0}: {1}",
+            kernel_name,
+            ec.message()));
+      }
+    }
   }
 
   // load library
@@ -194,6 +240,14 @@ inline void build_kernel(
   }
 
   if (contiguous) {
+    // Each output element only depends on the same element of the inputs,
+    // even when an output is donated an input buffer, so there are no loop
+    // carried dependencies and the loop can be vectorized.
+    os << "#if defined(__clang__)" << std::endl
+       << "  #pragma clang loop vectorize(enable)" << std::endl
+       << "#elif defined(__GNUC__)" << std::endl
+       << "  #pragma GCC ivdep" << std::endl
+       << "#endif" << std::endl;
     os << "  for (size_t i = 0; i < size; ++i) {" << std::endl;
   } else {
     for (int d = 0; d < ndim; ++d) {
@@ -1,4 +1,5 @@
 // Copyright © 2023-2024 Apple Inc.
+#include <algorithm>
 #include <cstdlib>
 #include <map>
 #include <sstream>
@@ -9,6 +10,7 @@
 #include "mlx/backend/common/compiled.h"
 #include "mlx/compile.h"
 #include "mlx/compile_impl.h"
+#include "mlx/dtype_utils.h"
 #include "mlx/fast_primitives.h"
 #include "mlx/graph_utils.h"
 #include "mlx/primitives.h"
@@ -68,6 +70,83 @@ bool is_noop(const Primitive& p) {
   return typeid(p) == typeid(Copy) || typeid(p) == typeid(StopGradient);
 }
 
+bool is_commutative(const Primitive& p) {
+  return (
+      typeid(p) == typeid(Add) || typeid(p) == typeid(Multiply) ||
+      typeid(p) == typeid(Equal) || typeid(p) == typeid(NotEqual) ||
+      typeid(p) == typeid(LogicalAnd) || typeid(p) == typeid(LogicalOr) ||
+      typeid(p) == typeid(Maximum) || typeid(p) == typeid(Minimum));
+}
+
+// Check if the array is an evaluated scalar equal to the given value. The
+// scalar can be broadcast, as binary ops do with scalar operands.
+bool is_scalar_value(const array& a, int value) {
+  // The broadcast input comes first followed by any stop gradient inputs
+  // added during dynamic tracing
+  auto& c =
+      (a.has_primitive() && is_broadcast(a.primitive())) ? a.inputs()[0] : a;
+  if (!c.is_available() || c.ndim() != 0) {
+    return false;
+  }
+  bool equal = false;
+  MLX_SWITCH_ALL_TYPES(
+      c.dtype(), CTYPE, equal = *c.data<CTYPE>() == static_cast<CTYPE>(value));
+  return equal;
+}
+
+// Return the index of the input that the array simply forwards, e.g. the
+// input of a copy or x in x * 1, or -1 if there is no such input
+int forwarded_input(const array& a, bool shapeless) {
+  if (!a.has_primitive() || !a.siblings().empty()) {
+    return -1;
+  }
+  auto& p = a.primitive();
+  if (is_noop(p)) {
+    return 0;
+  }
+  auto& inputs = a.inputs();
+  if (inputs.size() != 2) {
+    return -1;
+  }
+  // The traced shapes can change when shapeless so the scalar must be 0-d or
+  // broadcast to the shape of x itself for the output to have x's shape
+  auto matches = [&a, shapeless](const array& x, const array& scalar) {
+    if (x.dtype() != a.dtype() || x.shape() != a.shape()) {
+      return false;
+    }
+    if (!shapeless || !scalar.has_primitive()) {
+      return true;
+    }
+    auto& shape_inputs = scalar.inputs();
+    return shape_inputs.size() > 1 &&
+        std::all_of(
+               shape_inputs.begin() + 1,
+               shape_inputs.end(),
+               [&x](const array& in) {
+                 bool is_stop_gradient = in.has_primitive() &&
+                     typeid(in.primitive()) == typeid(StopGradient);
+                 return (is_stop_gradient ? in.inputs()[0] : in).id() == x.id();
+               });
+  };
+  // x + 0 is only an identity for integers since -0.0 + 0 is +0.0
+  bool is_add = typeid(p) == typeid(Add) && !issubdtype(a.dtype(), inexact);
+  if (typeid(p) == typeid(Multiply) || is_add) {
+    int identity = is_add ? 0 : 1;
+    for (int i = 0; i < 2; ++i) {
+      if (is_scalar_value(inputs[1 - i], identity) &&
+          matches(inputs[i], inputs[1 - i])) {
+        return i;
+      }
+    }
+  } else if (typeid(p) == typeid(Subtract) || typeid(p) == typeid(Divide)) {
+    int identity = typeid(p) == typeid(Subtract) ? 0 : 1;
+    if (is_scalar_value(inputs[1], identity) && matches(inputs[0], inputs[1])) {
+      return 0;
+    }
+  }
+  return -1;
+}
+
 bool is_reduction(const Primitive& p) {
   return typeid(p) == typeid(Reduce) || typeid(p) == typeid(ArgReduce);
 }
@@ -291,6 +370,7 @@ class CompilerCache {
     std::vector<array> tape;
     bool empty{true};
     std::vector<uint64_t> constants;
+    uint64_t constants_hash{0};
   };
 
   // Returns a reference to a CacheEntry which can be updated
@@ -310,24 +390,36 @@ class CompilerCache {
       if (in1.size() != in2.size()) {
         return false;
       }
+      // Check the scalar metadata of all inputs before comparing any shapes
       for (size_t i = 0; i < in1.size(); ++i) {
-        if (in1[i].ndim() != in2[i].ndim()) {
+        if (in1[i].dtype() != in2[i].dtype() ||
+            in1[i].ndim() != in2[i].ndim()) {
           return false;
         }
-        if (!shapeless && in1[i].shape() != in2[i].shape()) {
-          return false;
-        }
-        if (in1[i].dtype() != in2[i].dtype()) {
+      }
+      if (shapeless) {
+        return true;
+      }
+      for (size_t i = 0; i < in1.size(); ++i) {
+        if (!std::equal(
+                in1[i].shape().begin(),
+                in1[i].shape().end(),
+                in2[i].shape().begin())) {
           return false;
         }
       }
       return true;
     };
+    // Fingerprint the constants once so entries with different constants
+    // are skipped without comparing them element by element.
+    auto constants_hash = hash_constants(constants);
+
     // Loop over entries and check:
     // - Default stream and device match the entry's default stream
     // - Inputs match i.e. shapes and types must be equal.
     auto stream = default_stream(default_device());
-    for (CacheEntry& entry : entries) {
+    for (size_t i = 0; i < entries.size(); ++i) {
+      CacheEntry& entry = entries[i];
       // Check that the default stream and device match
       if (entry.stream != stream) {
         continue;
@@ -335,15 +427,23 @@ class CompilerCache {
       if (entry.shapeless != shapeless) {
         continue;
       }
+      if (entry.constants_hash != constants_hash) {
+        continue;
+      }
 
-      // Check the inputs match and return if so
+      // Check the inputs match and return if so. The matching entry is moved
+      // to the front since repeated calls usually have the same inputs.
       if (has_same_shape_and_dtype(inputs, entry.inputs) &&
           constants == entry.constants) {
-        return entry;
+        if (i > 0) {
+          std::swap(entries[0], entry);
+        }
+        return entries[0];
       }
     }
     // Otherwise append a new cache entry
     entries.push_back(CacheEntry{stream, shapeless});
+    entries.back().constants_hash = constants_hash;
     return entries.back();
   }
 
@@ -356,6 +456,14 @@ class CompilerCache {
   }
 
  private:
+  static uint64_t hash_constants(const std::vector<uint64_t>& constants) {
+    uint64_t seed = constants.size();
+    for (auto c : constants) {
+      seed ^= c + 0x9e3779b97f4a7c15 + (seed << 6) + (seed >> 2);
+    }
+    return seed;
+  }
+
   CompilerCache() {
     // Make sure the allocator is fully
     // initialized before the compiler cache
@@ -371,6 +479,16 @@ CompilerCache& compiler_cache() {
   return compiler_cache_;
 }
 
+// Ids of the placeholder inputs of the functions being traced for compile
+static std::unordered_set<std::uintptr_t>& compile_placeholders() {
+  static std::unordered_set<std::uintptr_t> compile_placeholders_;
+  return compile_placeholders_;
+}
+
+bool is_compile_placeholder(const array& a) {
+  return compile_placeholders().find(a.id()) != compile_placeholders().end();
+}
+
 std::pair<std::vector<array>, std::vector<array>> compile_trace(
     const std::function<std::vector<array>(const std::vector<array>&)>& fun,
     const std::vector<array>& inputs,
@@ -386,6 +504,20 @@ std::pair<std::vector<array>, std::vector<array>> compile_trace(
     in.set_tracer(true);
     tracer_inputs.push_back(std::move(in));
   }
+
+  // Register the placeholders while tracing so explicit evals of arrays
+  // computed from them can be skipped
+  struct PlaceholderScope {
+    const std::vector<array>& placeholders;
+    ~PlaceholderScope() {
+      for (auto& in : placeholders) {
+        compile_placeholders().erase(in.id());
+      }
+    }
+  } placeholder_scope{tracer_inputs};
+  for (auto& in : tracer_inputs) {
+    compile_placeholders().insert(in.id());
+  }
   return {tracer_inputs, fun(tracer_inputs)};
 }
 
@@ -446,7 +578,8 @@ void compile_simplify(
     std::vector<array>& tape,
     ParentsMap& parents_map,
     std::vector<array>& outputs,
-    int passes) {
+    int passes,
+    bool shapeless) {
   // Helpers to identify identical scalars
   std::map<std::pair<uint64_t, Dtype::Val>, array> scalars;
   auto is_scalar = [](const array& a) {
@@ -497,13 +630,23 @@ void compile_simplify(
       return false;
     }
 
-    for (int i = 0; i < a.inputs().size(); i++) {
-      if (a.inputs()[i].id() != b.inputs()[i].id()) {
-        return false;
+    auto& a_in = a.inputs();
+    auto& b_in = b.inputs();
+    bool same_inputs = true;
+    for (int i = 0; i < a_in.size(); i++) {
+      if (a_in[i].id() != b_in[i].id()) {
+        same_inputs = false;
+        break;
       }
     }
 
-    return pa.is_equivalent(pb);
+    // The inputs of commutative binary primitives can be in either order
+    if (!same_inputs && a_in.size() == 2 && is_commutative(pa)) {
+      same_inputs =
+          a_in[0].id() == b_in[1].id() && a_in[1].id() == b_in[0].id();
+    }
+
+    return same_inputs && pa.is_equivalent(pb);
   };
 
   // Merge scalars
@@ -522,23 +665,74 @@ void compile_simplify(
   }
   tape = std::move(new_tape);
 
-  // Remove no-ops
+  // Remove no-ops and identity arithmetic like x * 1
   {
     std::unordered_map<uintptr_t, array> output_map;
     for (auto& o : outputs) {
       output_map.insert({o.id(), o});
     }
+    auto is_output = [&output_map](const array& a) {
+      return std::any_of(
+          output_map.begin(), output_map.end(), [&a](const auto& o) {
+            return o.first == a.id() || o.second.id() == a.id();
+          });
+    };
+
+    // Remove the parent from the parents of the array and drop the array
+    // too if that leaves it unused, e.g. the broadcast constant in x * 1
+    std::unordered_set<uintptr_t> orphans;
+    std::function<void(const array&, const array&)> remove_parent;
+    remove_parent = [&](const array& a, const array& parent) {
+      auto parents = parents_map.find(a.id());
+      if (parents == parents_map.end()) {
+        return;
+      }
+      auto& pairs = parents->second;
+      pairs.erase(
+          std::remove_if(
+              pairs.begin(),
+              pairs.end(),
+              [&parent](auto& p) { return p.first.id() == parent.id(); }),
+          pairs.end());
+      if (pairs.empty() && a.has_primitive() && a.siblings().empty() &&
+          !is_output(a)) {
+        parents_map.erase(parents);
+        orphans.insert(a.id());
+        for (auto& in : a.inputs()) {
+          remove_parent(in, a);
+        }
+      }
+    };
+
     for (auto& arr : tape) {
-      if (!arr.has_primitive() || !is_noop(arr.primitive())) {
+      int idx = forwarded_input(arr, shapeless);
+      if (idx < 0) {
         new_tape.push_back(std::move(arr));
         continue;
       }
-      merge_one(arr.inputs()[0], arr, parents_map);
+      auto& inputs = arr.inputs();
       if (auto it = output_map.find(arr.id()); it != output_map.end()) {
-        it->second = arr.inputs()[0];
+        it->second = inputs[idx];
+      }
+      for (int i = 0; i < inputs.size(); ++i) {
+        if (i != idx) {
+          remove_parent(inputs[i], arr);
+        }
+      }
+      if (parents_map.find(arr.id()) == parents_map.end()) {
+        // Nothing to rewire, only detach the array from its input
+        remove_parent(inputs[idx], arr);
+      } else {
+        merge_one(inputs[idx], arr, parents_map);
       }
     }
-    tape = std::move(new_tape);
+    tape.clear();
+    for (auto& arr : new_tape) {
+      if (orphans.find(arr.id()) == orphans.end()) {
+        tape.push_back(std::move(arr));
+      }
+    }
+    new_tape.clear();
     for (auto& o : outputs) {
       o = output_map.at(o.id());
     }
@@ -862,6 +1056,19 @@ std::vector<array> compile_replace(
     trace_to_real.insert({trace_inputs[i].id(), inputs[i]});
   }
 
+  // If the inputs have the same shapes as the traced inputs then the traced
+  // shapes are valid and don't need to be inferred again
+  if (shapeless) {
+    shapeless = !std::equal(
+        inputs.begin(),
+        inputs.end(),
+        trace_inputs.begin(),
+        trace_inputs.end(),
+        [](const array& in, const array& t_in) {
+          return in.shape() == t_in.shape();
+        });
+  }
+
   auto is_load = [](const Primitive& p) { return typeid(p) == typeid(Load); };
 
   for (auto& a : tape) {
@@ -970,7 +1177,7 @@ std::function<std::vector<array>(const std::vector<array>&)> compile(
       // Simplify the tape
       if (compile_mode() != CompileMode::no_simplify) {
         compile_simplify(
-            entry.tape, parents_map, entry.outputs, /* passes */ 3);
+            entry.tape, parents_map, entry.outputs, /* passes */ 3, shapeless);
       }
 
       // Kernel fusion to generate Compiled primitives. The tape and
@@ -25,6 +25,9 @@ void compile_clear_cache();
 
 bool compile_available_for_device(const Device& device);
 
+// Check if the array is a placeholder input of a function being compiled
+bool is_compile_placeholder(const array& a);
+
 std::pair<std::vector<array>, std::vector<array>> compile_trace(
     const std::function<std::vector<array>(const std::vector<array>&)>& fun,
     const std::vector<array>& inputs,
@@ -44,7 +47,8 @@ void compile_simplify(
     std::vector<array>& tape,
     ParentsMap& parents_map,
     std::vector<array>& outputs,
-    int passes);
+    int passes,
+    bool shapeless = false);
 
 std::vector<array> compile_replace(
     const std::vector<array>& tape,
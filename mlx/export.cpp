@@ -592,7 +592,8 @@ void FunctionExporter::export_function(const Args& args, const Kwargs& kwargs) {
   auto [tape, parents_map] =
       detail::compile_dfs(trace_inputs, trace_outputs, inputs);
 
-  detail::compile_simplify(tape, parents_map, trace_outputs, /* passes */ 3);
+  detail::compile_simplify(
+      tape, parents_map, trace_outputs, /* passes */ 3, ftable->shapeless);
 
   // Update header
   count++;
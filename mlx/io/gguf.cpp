@@ -352,7 +352,7 @@ void save_gguf(
         throw std::runtime_error("[save_gguf] Cannot save empty arrays.");
       }
 
-      eval(v);
+      v.eval();
       if (!v.flags().row_contiguous) {
         v = reshape(flatten(v), v.shape());
       }
@@ -10,6 +10,7 @@
 #include "mlx/ops.h"
 #include "mlx/primitives.h"
 #include "mlx/transforms.h"
+#include "mlx/transforms_impl.h"
 
 using json = nlohmann::json;
 
@@ -282,7 +283,7 @@ void save_safetensors(
       p.second = contiguous(p.second);
       to_eval.push_back(p.second);
     }
-    eval(std::move(to_eval));
+    detail::eval_values(std::move(to_eval));
   }
 
   size_t offset = 0;
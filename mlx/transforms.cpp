@@ -11,6 +11,7 @@
 
 #include "mlx/backend/cpu/eval.h"
 #include "mlx/backend/gpu/eval.h"
+#include "mlx/compile_impl.h"
 #include "mlx/fence.h"
 #include "mlx/memory.h"
 #include "mlx/ops.h"
@@ -274,6 +275,61 @@ array eval_impl(std::vector<array> outputs, bool async) {
   return synchronizer;
 }
 
+// Remove the arrays which are computed from the placeholder inputs of a
+// function being compiled. They have no values yet so they are left to
+// compile rather than evaluated.
+void remove_compile_placeholder_dependents(std::vector<array>& outputs) {
+  if (!detail::in_tracing()) {
+    return;
+  }
+
+  // Map of array id to whether it depends on a placeholder
+  std::unordered_map<std::uintptr_t, bool> cache;
+  std::stack<std::pair<std::reference_wrapper<const array>, int>> dfs;
+  auto depends = [&](const array& x) {
+    if (auto it = cache.find(x.id()); it != cache.end()) {
+      return it->second;
+    }
+    dfs.emplace(x, 0);
+    while (!dfs.empty()) {
+      auto& [a_ref, idx] = dfs.top();
+      auto& a = a_ref.get();
+      if (idx == 0) {
+        if (a.status() != array::Status::unscheduled) {
+          cache.insert({a.id(), false});
+          dfs.pop();
+          continue;
+        }
+        if (!a.has_primitive()) {
+          cache.insert({a.id(), detail::is_compile_placeholder(a)});
+          dfs.pop();
+          continue;
+        }
+      }
+      if (idx < a.inputs().size()) {
+        auto& in = a.inputs()[idx++];
+        if (cache.find(in.id()) == cache.end()) {
+          dfs.emplace(in, 0);
+        }
+        continue;
+      }
+      bool found = std::any_of(
+          a.inputs().begin(), a.inputs().end(), [&cache](const array& in) {
+            return cache.at(in.id());
+          });
+      cache.insert({a.id(), found});
+      for (auto& s : a.siblings()) {
+        cache.insert({s.id(), found});
+      }
+      dfs.pop();
+    }
+    return cache.at(x.id());
+  };
+
+  outputs.erase(
+      std::remove_if(outputs.begin(), outputs.end(), depends), outputs.end());
+}
+
 void async_eval(std::vector<array> outputs) {
   if (outputs.empty()) {
     return;
@@ -288,7 +344,7 @@ void async_eval(std::vector<array> outputs) {
   eval_impl(std::move(outputs), true);
 }
 
-void eval(std::vector<array> outputs) {
+void detail::eval_values(std::vector<array> outputs) {
   if (outputs.empty()) {
     return;
   }
@@ -305,6 +361,13 @@ void eval(std::vector<array> outputs) {
   eval_impl(std::move(outputs), false).event().wait();
 }
 
+void eval(std::vector<array> outputs) {
+  // An explicit eval inside a compiled function only sequences the graph,
+  // the values of the arrays computed from its inputs are not read
+  remove_compile_placeholder_dependents(outputs);
+  detail::eval_values(std::move(outputs));
+}
+
 std::pair<std::vector<array>, std::vector<array>> vjp(
     const std::function<std::vector<array>(const std::vector<array>&)>& fun,
     const std::vector<array>& primals,
@@ -16,6 +16,10 @@ std::vector<array> vmap_replace(
     const std::vector<int>& in_axes,
     const std::vector<int>& out_axes);
 
+// Evaluate the arrays to read their values. Unlike eval, this does not skip
+// the arrays computed from the inputs of a function being compiled.
+void eval_values(std::vector<array> outputs);
+
 // Create an InTracing object during tracing operations to signify to the rest
 // of the codebase that we are during tracing so evals should not throw away
 // the graph.
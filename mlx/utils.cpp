@@ -1,5 +1,6 @@
 // Copyright © 2023 Apple Inc.
 
+#include <algorithm>
 #include <cstdlib>
 #include <iostream>
 #include <sstream>
@@ -109,24 +110,22 @@ Shape broadcast_shapes(const Shape& s1, const Shape& s2) {
   const auto& big = ndim1 > ndim2 ? s1 : s2;
   const auto& small = ndim1 > ndim2 ? s2 : s1;
   Shape out_shape(ndim);
-  for (int i = ndim - 1; i >= diff; --i) {
+  // Check all the axes at once after the loop so that it stays branch free
+  bool broadcastable = true;
+  for (int i = diff; i < ndim; ++i) {
     auto a = big[i];
     auto b = small[i - diff];
-    if (b == a) {
-      out_shape[i] = a;
-    } else if (a == 1 || b == 1) {
-      // 0 if a or b is 0 otherwise max(a, b)
-      out_shape[i] = a * b;
-    } else {
-      std::ostringstream msg;
-      msg << "[broadcast_shapes] Shapes " << s1 << " and " << s2
-          << " cannot be broadcast.";
-      throw std::invalid_argument(msg.str());
-    }
+    broadcastable &= (a == b) | (a == 1) | (b == 1);
+    // b if a is 1 (this is 0 if b is 0) otherwise a
+    out_shape[i] = (a == 1) ? b : a;
   }
-  for (int i = diff - 1; i >= 0; --i) {
-    out_shape[i] = big[i];
+  if (!broadcastable) {
+    std::ostringstream msg;
+    msg << "[broadcast_shapes] Shapes " << s1 << " and " << s2
+        << " cannot be broadcast.";
+    throw std::invalid_argument(msg.str());
   }
+  std::copy(big.begin(), big.begin() + diff, out_shape.begin());
   return out_shape;
 }
 
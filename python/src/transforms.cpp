@@ -445,31 +445,29 @@ struct PyCompiledFun {
     std::function<void(nb::handle)> recurse;
     recurse = [&](nb::handle obj) {
       if (nb::isinstance<nb::list>(obj)) {
-        auto l = nb::cast<nb::list>(obj);
         constants.push_back(list_identifier);
-        for (int i = 0; i < l.size(); ++i) {
-          recurse(l[i]);
+        for (auto item : nb::borrow<nb::list>(obj)) {
+          recurse(item);
         }
       } else if (nb::isinstance<nb::tuple>(obj)) {
-        auto l = nb::cast<nb::tuple>(obj);
         constants.push_back(list_identifier);
-        for (auto item : obj) {
+        for (auto item : nb::borrow<nb::tuple>(obj)) {
           recurse(item);
         }
       } else if (nb::isinstance<nb::dict>(obj)) {
         auto d = nb::cast<nb::dict>(obj);
         constants.push_back(dict_identifier);
         for (auto item : d) {
-          auto r = item.first.attr("__hash__")();
-          constants.push_back(nb::cast<int64_t>(r));
+          constants.push_back(nb::hash(item.first));
           recurse(item.second);
         }
-      } else if (nb::isinstance<mx::array>(obj)) {
-        inputs.push_back(nb::cast<mx::array>(obj));
+      } else if (mx::array* a = nullptr; nb::try_cast(obj, a, false) && a) {
+        // Check and cast arrays with a single type lookup
+        inputs.push_back(*a);
         constants.push_back(array_identifier);
       } else if (nb::isinstance<nb::str>(obj)) {
-        auto r = obj.attr("__hash__")();
-        constants.push_back(nb::cast<int64_t>(r));
+        // Strings cache their hash so this is cheap on repeated calls
+        constants.push_back(nb::hash(obj));
       } else if (nb::isinstance<nb::int_>(obj)) {
         constants.push_back(nb::cast<int64_t>(obj));
       } else if (nb::isinstance<nb::float_>(obj)) {
@@ -487,13 +485,20 @@ struct PyCompiledFun {
     recurse(args);
     int num_args = inputs.size();
     recurse(kwargs);
-    auto compile_fun = [this, &args, &kwargs, num_args](
+
+    // Flatten the captured inputs once and reuse them when tracing
+    std::vector<mx::array> flat_in_captures;
+    if (!captured_inputs.is_none()) {
+      flat_in_captures = tree_flatten(captured_inputs, false);
+      inputs.insert(
+          inputs.end(), flat_in_captures.begin(), flat_in_captures.end());
+    }
+
+    auto compile_fun = [this, &args, &kwargs, &flat_in_captures, num_args](
                            const std::vector<mx::array>& a) {
       // Put tracers into captured inputs
-      std::vector<mx::array> flat_in_captures;
       std::vector<mx::array> trace_captures;
       if (!captured_inputs.is_none()) {
-        flat_in_captures = tree_flatten(captured_inputs, false);
         trace_captures.insert(
             trace_captures.end(), a.end() - flat_in_captures.size(), a.end());
         tree_fill(captured_inputs, trace_captures);
@@ -522,14 +527,6 @@ struct PyCompiledFun {
       return outputs;
     };
 
-    if (!captured_inputs.is_none()) {
-      auto flat_in_captures = tree_flatten(captured_inputs, false);
-      inputs.insert(
-          inputs.end(),
-          std::make_move_iterator(flat_in_captures.begin()),
-          std::make_move_iterator(flat_in_captures.end()));
-    }
-
     // Compile and call
     auto outputs =
         mx::detail::compile(compile_fun, fun_id, shapeless, constants)(inputs);
@@ -1155,6 +1152,11 @@ void init_transforms(nb::module_& m) {
               or a tree of arrays. If a tree is given the nodes can be a Python
               :class:`list`, :class:`tuple` or :class:`dict`. Leaves which are not
               arrays are ignored.
+
+        .. note::
+
+          Inside a function transformed by :func:`compile`, arrays that
+          depend on the function inputs are not evaluated.
       )pbdoc");
   m.def(
       "async_eval",
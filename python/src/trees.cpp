@@ -21,37 +21,40 @@ nb::object tree_map(
 
   recurse = [&](const std::vector<nb::object>& subtrees) {
     if (nb::isinstance<nb::list>(subtrees[0])) {
-      nb::list l;
+      // Fill a preallocated list to avoid resizing it on every append
       std::vector<nb::object> items(subtrees.size());
       validate_subtrees<nb::list, nb::tuple, nb::dict>(subtrees);
-      for (int i = 0; i < nb::cast<nb::list>(subtrees[0]).size(); ++i) {
+      size_t len = nb::borrow<nb::list>(subtrees[0]).size();
+      auto l = nb::steal<nb::list>(PyList_New(len));
+      for (size_t i = 0; i < len; ++i) {
         for (int j = 0; j < subtrees.size(); ++j) {
           if (nb::isinstance<nb::list>(subtrees[j])) {
-            items[j] = nb::cast<nb::list>(subtrees[j])[i];
+            items[j] = nb::borrow<nb::list>(subtrees[j])[i];
           } else {
             items[j] = subtrees[j];
           }
         }
-        l.append(recurse(items));
+        PyList_SET_ITEM(l.ptr(), i, recurse(items).release().ptr());
       }
       return nb::cast<nb::object>(l);
     } else if (nb::isinstance<nb::tuple>(subtrees[0])) {
       //  Check the rest of the subtrees
       std::vector<nb::object> items(subtrees.size());
-      int len = nb::cast<nb::tuple>(subtrees[0]).size();
-      nb::list l;
+      size_t len = nb::borrow<nb::tuple>(subtrees[0]).size();
       validate_subtrees<nb::tuple, nb::list, nb::dict>(subtrees);
-      for (int i = 0; i < len; ++i) {
+      // Build the tuple directly instead of going through a list
+      auto t = nb::steal<nb::tuple>(PyTuple_New(len));
+      for (size_t i = 0; i < len; ++i) {
         for (int j = 0; j < subtrees.size(); ++j) {
           if (nb::isinstance<nb::tuple>(subtrees[j])) {
-            items[j] = nb::cast<nb::tuple>(subtrees[j])[i];
+            items[j] = nb::borrow<nb::tuple>(subtrees[j])[i];
           } else {
             items[j] = subtrees[j];
           }
         }
-        l.append(recurse(items));
+        PyTuple_SET_ITEM(t.ptr(), i, recurse(items).release().ptr());
       }
-      return nb::cast<nb::object>(nb::tuple(l));
+      return nb::cast<nb::object>(t);
     } else if (nb::isinstance<nb::dict>(subtrees[0])) {
       std::vector<nb::object> items(subtrees.size());
       validate_subtrees<nb::dict, nb::list, nb::tuple>(subtrees);
@@ -149,9 +152,12 @@ void tree_visit(
 void tree_visit(nb::handle tree, std::function<void(nb::handle)> visitor) {
   std::function<void(nb::handle)> recurse;
   recurse = [&](nb::handle subtree) {
-    if (nb::isinstance<nb::list>(subtree) ||
-        nb::isinstance<nb::tuple>(subtree)) {
-      for (auto item : subtree) {
+    if (nb::isinstance<nb::list>(subtree)) {
+      for (auto item : nb::borrow<nb::list>(subtree)) {
+        recurse(item);
+      }
+    } else if (nb::isinstance<nb::tuple>(subtree)) {
+      for (auto item : nb::borrow<nb::tuple>(subtree)) {
         recurse(item);
       }
     } else if (nb::isinstance<nb::dict>(subtree)) {
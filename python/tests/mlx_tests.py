@@ -9,6 +9,14 @@ import mlx.core as mx
 import numpy as np
 
 
+def get_test_device():
+    # The device set with the DEVICE environment variable or the default one
+    device = os.getenv("DEVICE", None)
+    if device is not None:
+        return getattr(mx, device)
+    return mx.default_device()
+
+
 class MLXTestRunner(unittest.TestProgram):
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
@@ -17,11 +25,7 @@ class MLXTestRunner(unittest.TestProgram):
         super().createTests(*args, **kwargs)
 
         # Asume CUDA backend in this case
-        device = os.getenv("DEVICE", None)
-        if device is not None:
-            device = getattr(mx, device)
-        else:
-            device = mx.default_device()
+        device = get_test_device()
 
         if not (device == mx.gpu and not mx.metal.is_available()):
             return
@@ -52,10 +56,7 @@ class MLXTestCase(unittest.TestCase):
 
     def setUp(self):
         self.default = mx.default_device()
-        device = os.getenv("DEVICE", None)
-        if device is not None:
-            device = getattr(mx, device)
-            mx.set_default_device(device)
+        mx.set_default_device(get_test_device())
 
     def tearDown(self):
         mx.set_default_device(self.default)
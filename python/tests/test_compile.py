@@ -3,6 +3,10 @@
 import gc
 import io
 import math
+import os
+import subprocess
+import sys
+import tempfile
 import unittest
 from functools import partial
 from io import StringIO
@@ -157,7 +161,10 @@ class TestCompile(mlx_tests.MLXTestCase):
         self.assertEqual(out.item(), 4)
 
     def test_function_creates_array(self):
+        n_traces = [0]
+
         def fun(x):
+            n_traces[0] += 1
             return x + mx.array(1)
 
         cfun = mx.compile(fun)
@@ -168,6 +175,9 @@ class TestCompile(mlx_tests.MLXTestCase):
         out = cfun(mx.array(3))
         self.assertEqual(out.item(), 4)
 
+        # The constant is created once during tracing and reused after
+        self.assertEqual(n_traces[0], 1)
+
     def test_enable_disable(self):
         def fun(x):
             y = x + 1
@@ -235,6 +245,9 @@ class TestCompile(mlx_tests.MLXTestCase):
         out = mx.vmap(mx.compile(simple_binary), in_axes=(0, None))(x, y)
         self.assertTrue(mx.allclose(expected_out, out))
 
+        out = mx.compile(mx.vmap(simple_binary, in_axes=(0, None)))(x, y)
+        self.assertTrue(mx.allclose(expected_out, out))
+
         def simple_unary_outer(x):
             x = mx.abs(x)
 
@@ -305,6 +318,38 @@ class TestCompile(mlx_tests.MLXTestCase):
         cdfdx = mx.grad(outer)(x)
         self.assertTrue(mx.allclose(dfdx, cdfdx))
 
+    def test_eval_in_compiled(self):
+        def fun(x):
+            y = mx.exp(mx.abs(x))
+            mx.eval(y)
+            return y.sum()
+
+        x = mx.array([2.0, -1.0, 0.5])
+        self.assertTrue(mx.allclose(mx.compile(fun)(x), fun(x)))
+
+        # The inputs of the gradient are placeholders of the compiled function
+        def outer(x):
+            return mx.sin(x).sum() + fun(x)
+
+        expected = mx.grad(outer)(x)
+        self.assertTrue(mx.allclose(mx.compile(mx.grad(outer))(x), expected))
+
+        # Reading the values still raises
+        def read_fun(x):
+            y = mx.exp(mx.abs(x))
+            mx.eval(y)
+            return y.sum() * y[0].item()
+
+        with self.assertRaises(ValueError):
+            mx.compile(read_fun)(x)
+
+        with self.assertRaises(ValueError):
+            mx.vmap(read_fun)(mx.stack([x, x]))
+
+        # Only compile skips the eval
+        with self.assertRaises(ValueError):
+            mx.vmap(fun)(mx.stack([x, x]))
+
     def test_compile_capture(self):
         # Test update captured state outside compiled function
         state = {"y": mx.array(2)}
@@ -459,6 +504,10 @@ class TestCompile(mlx_tests.MLXTestCase):
         mx.eval(cfun(x1))
         self.assertTrue(mx.array_equal(fun(x2), cfun(x2)))
 
+        # Change the length of the reduced axis
+        x3 = mx.arange(10).reshape(2, 5)
+        self.assertTrue(mx.array_equal(fun(x3), cfun(x3)))
+
         def fun(x):
             return x * x.sum(-1, keepdims=False)
 
@@ -706,6 +755,31 @@ class TestCompile(mlx_tests.MLXTestCase):
         self.assertTrue(repr(out) is not None)
         self.assertTrue(mx.array_equal(out, mx.array([4.0])))
 
+    def test_compile_cache_dir(self):
+        # The cache directory is read once per process so compile in a new one
+        code = (
+            "import mlx.core as mx\n"
+            "mx.set_default_device(mx.cpu)\n"
+            "fun = mx.compile(lambda x: mx.exp(mx.abs(x)) + 1.0)\n"
+            "mx.eval(fun(mx.array([1.0, -2.0])))\n"
+        )
+        with tempfile.TemporaryDirectory() as cache_dir:
+            env = dict(os.environ, MLX_COMPILE_CACHE_DIR=cache_dir)
+
+            def compiled_libs():
+                subprocess.run([sys.executable, "-c", code], env=env, check=True)
+                return {
+                    f: os.path.getmtime(os.path.join(cache_dir, f))
+                    for f in os.listdir(cache_dir)
+                    if f.endswith(".so")
+                }
+
+            libs = compiled_libs()
+            self.assertEqual(len(libs), 1)
+
+            # The library is reused by the next process
+            self.assertEqual(compiled_libs(), libs)
+
     def test_compile_with_long_name(self):
         def fn(a, b):
             for _ in range(10):
@@ -714,6 +788,16 @@ class TestCompile(mlx_tests.MLXTestCase):
             return a + b
 
         out = mx.compile(fn)(mx.array(10.0), mx.array(20.0))
+
+        s = StringIO()
+        mx.export_to_dot(s, out)
+        s.seek(0)
+        s = s.read()
+
+        # The whole chain is a single fused primitive
+        self.assertEqual(s.count("label"), 1)
+        self.assertTrue("Compiled" in s)
+        self.assertEqual(s.count("Subtract"), 20)
         self.assertEqual(out.item(), 10.0)
 
     def test_compile_multi_output(self):
@@ -876,6 +960,11 @@ class TestCompile(mlx_tests.MLXTestCase):
         out = compiled_fun(x)
         self.assertEqual(out.shape, (6, 8))
 
+        # Back to the traced shape
+        x = mx.zeros(shape=(2, 3, 4))
+        out = compiled_fun(x)
+        self.assertEqual(out.shape, (6, 4))
+
         x = mx.zeros(shape=(5, 5, 5))
 
         with self.assertRaises(ValueError):
@@ -961,7 +1050,7 @@ class TestCompile(mlx_tests.MLXTestCase):
         else:
             mem_pre = 0
 
-        def outer():
+        def outer(call):
             d = {}
 
             def f(x):
@@ -970,9 +1059,15 @@ class TestCompile(mlx_tests.MLXTestCase):
             d["f"] = mx.compile(f)
             d["x"] = mx.array([0] * 1000)
 
-        for _ in range(5):
-            outer()
-            gc.collect()
+            # Calling fills the compile cache which should be released
+            # along with the compiled function
+            if call:
+                mx.eval(d["f"](mx.array(1.0)))
+
+        for call in [False, True]:
+            for _ in range(5):
+                outer(call)
+                gc.collect()
 
         if mx.metal.is_available():
             mem_post = mx.get_active_memory()
@@ -1,9 +1,10 @@
 # Copyright © 2023 Apple Inc.
 
-import inspect
 import math
 import unittest
-from functools import partial
+from functools import lru_cache, partial
+from io import StringIO
+from types import MappingProxyType
 
 import mlx.core as mx
 import mlx.nn as nn
@@ -22,27 +23,69 @@ except ImportError as e:
     has_torch = False
 
 
+@lru_cache(maxsize=1)
 def get_all_optimizers():
-    classes = dict()
-    for name, obj in inspect.getmembers(opt):
-        if (
-            inspect.isclass(obj)
-            and issubclass(obj, opt.Optimizer)
-            and obj != opt.Optimizer
-        ):
-            classes[name] = obj
-    return classes
+    classes = {
+        name: obj
+        for name, obj in vars(opt).items()
+        if isinstance(obj, type)
+        and issubclass(obj, opt.Optimizer)
+        and obj is not opt.Optimizer
+    }
+    return MappingProxyType(classes)
 
 
 def tree_equal(fn, *args):
-    return all(v for _, v in tree_flatten(tree_map(fn, *args)))
+    # Reduce all the leaves on device and synchronize once
+    leaves = [v for _, v in tree_flatten(tree_map(fn, *args))]
+    return len(leaves) == 0 or mx.stack(leaves).all().item()
 
 
-optimizers_dict = get_all_optimizers()
-del optimizers_dict["MultiOptimizer"]
+def _all_zero(params, state, key):
+    # Check the state entries have the shapes of the parameters and reduce
+    # all of them at once to check they are zero
+    p_leaves = [v for _, v in tree_flatten(params)]
+    entries = tree_map(lambda _, s: s[key], params, state)
+    s_leaves = [v for _, v in tree_flatten(entries)]
+    if any(p.shape != s.shape for p, s in zip(p_leaves, s_leaves)):
+        return False
+    return (mx.concatenate([s.flatten() for s in s_leaves]) == 0).all().item()
+
+
+optimizers_dict = MappingProxyType(
+    {k: v for k, v in get_all_optimizers().items() if k != "MultiOptimizer"}
+)
+
+
+def setUpModule():
+    # Build the kernels of every compiled optimizer update once on the test
+    # device before the tests run
+    with mx.stream(mlx_tests.get_test_device()):
+        params, grads = TestOptimizers._make_pg()
+        for optim_class in optimizers_dict.values():
+            optim = optim_class(0.1)
+            mx.eval(TestOptimizers._compiled_apply(optim, grads, params))
 
 
 class TestOptimizers(mlx_tests.MLXTestCase):
+    @staticmethod
+    def _make_pg():
+        params = {
+            "first": [mx.zeros((10,)), mx.zeros((1,))],
+            "second": mx.zeros((1,)),
+        }
+        return params, tree_map(mx.ones_like, params)
+
+    @staticmethod
+    def _compiled_apply(optim, grads, params):
+        optim.init(params)
+
+        @partial(mx.compile, inputs=optim.state, outputs=optim.state)
+        def step(grads, params):
+            return optim.apply_gradients(grads, params)
+
+        return step(grads, params)
+
     def test_optimizer_state(self):
         optim = opt.SGD(0.1)
         optim.state["hello"] = "world"
@@ -52,45 +95,36 @@ class TestOptimizers(mlx_tests.MLXTestCase):
         self.assertEqual(optim.state, {0: 1})
 
     def test_optimizers(self):
-        params = {
-            "first": [mx.zeros((10,)), mx.zeros((1,))],
-            "second": mx.zeros((1,)),
-        }
-        grads = tree_map(lambda x: mx.ones_like(x), params)
+        params, grads = self._make_pg()
 
-        for optim_class in optimizers_dict.values():
-            optim = optim_class(0.1)
-            update = optim.apply_gradients(grads, params)
-            mx.eval(update)
-            equal_shape = tree_map(lambda x, y: x.shape == y.shape, params, update)
-            all_equal = all(v for _, v in mlx.utils.tree_flatten(equal_shape))
-            self.assertTrue(all_equal)
+        for name, optim_class in optimizers_dict.items():
+            with self.subTest(optimizer=name):
+                optim = optim_class(0.1)
+                update = optim.apply_gradients(grads, params)
+                mx.eval(update)
+                equal_shape = tree_map(lambda x, y: x.shape == y.shape, params, update)
+                all_equal = all(v for _, v in mlx.utils.tree_flatten(equal_shape))
+                self.assertTrue(all_equal)
+
+                compiled_update = self._compiled_apply(optim_class(0.1), grads, params)
+                self.assertTrue(tree_equal(mx.allclose, update, compiled_update))
 
     def test_types_conserved(self):
         params = {"w": mx.ones((5, 5), mx.float16)}
         grads = tree_map(lambda x: mx.ones_like(x), params)
-        for optim_class in optimizers_dict.values():
-            optim = optim_class(0.1)
-            update = optim.apply_gradients(grads, params)
-            self.assertEqual(update["w"].dtype, mx.float16)
+        for name, optim_class in optimizers_dict.items():
+            with self.subTest(optimizer=name):
+                optim = optim_class(0.1)
+                update = optim.apply_gradients(grads, params)
+                self.assertEqual(update["w"].dtype, mx.float16)
 
     def test_sgd(self):
-        params = {
-            "first": [mx.zeros((10,)), mx.zeros((1,))],
-            "second": mx.zeros((1,)),
-        }
-        grads = tree_map(lambda x: mx.ones_like(x), params)
+        params, grads = self._make_pg()
 
         # Explicit init
         optim = opt.SGD(learning_rate=1e-2, momentum=0.9)
         optim.init(params)
-        self.assertTrue(
-            tree_equal(
-                lambda p, s: mx.array_equal(s["v"], mx.zeros_like(p)),
-                params,
-                optim.state,
-            )
-        )
+        self.assertTrue(_all_zero(params, optim.state, "v"))
 
         # Implicit init
         optim = opt.SGD(learning_rate=1e-2, momentum=0.9)
@@ -100,22 +134,12 @@ class TestOptimizers(mlx_tests.MLXTestCase):
         )
 
     def test_rmsprop(self):
-        params = {
-            "first": [mx.zeros((10,)), mx.zeros((1,))],
-            "second": mx.zeros((1,)),
-        }
-        grads = tree_map(lambda x: mx.ones_like(x), params)
+        params, grads = self._make_pg()
 
         # Explicit init
         optim = opt.RMSprop(learning_rate=1e-2)
         optim.init(params)
-        self.assertTrue(
-            tree_equal(
-                lambda p, s: mx.array_equal(s["v"], mx.zeros_like(p)),
-                params,
-                optim.state,
-            )
-        )
+        self.assertTrue(_all_zero(params, optim.state, "v"))
 
         # Implicit init
         alpha = 0.99
@@ -128,95 +152,112 @@ class TestOptimizers(mlx_tests.MLXTestCase):
         )
 
     def test_adagrad(self):
-        params = {
-            "first": [mx.zeros((10,)), mx.zeros((1,))],
-            "second": mx.zeros((1,)),
-        }
-        grads = tree_map(lambda x: mx.ones_like(x), params)
+        params, grads = self._make_pg()
 
         # Explicit init
         optim = opt.Adagrad(learning_rate=1e-2)
         optim.init(params)
-        self.assertTrue(
-            tree_equal(
-                lambda p, s: mx.array_equal(s["v"], mx.zeros_like(p)),
-                params,
-                optim.state,
-            )
-        )
+        self.assertTrue(_all_zero(params, optim.state, "v"))
 
     def test_adadelta(self):
-        params = {
-            "first": [mx.zeros((10,)), mx.zeros((1,))],
-            "second": mx.zeros((1,)),
-        }
-        grads = tree_map(lambda x: mx.ones_like(x), params)
+        params, grads = self._make_pg()
 
         # Explicit init
         optim = opt.AdaDelta(learning_rate=1e-2)
         optim.init(params)
-        self.assertTrue(
-            tree_equal(
-                lambda p, s: mx.array_equal(s["v"], mx.zeros_like(p)),
-                params,
-                optim.state,
-            )
-        )
-        self.assertTrue(
-            tree_equal(
-                lambda p, s: mx.array_equal(s["u"], mx.zeros_like(p)),
-                params,
-                optim.state,
-            )
-        )
+        self.assertTrue(_all_zero(params, optim.state, "v"))
+        self.assertTrue(_all_zero(params, optim.state, "u"))
 
     def test_adam(self):
-        params = {
-            "first": [mx.zeros((10,)), mx.zeros((1,))],
-            "second": mx.zeros((1,)),
-        }
-        grads = tree_map(lambda x: mx.ones_like(x), params)
+        params, grads = self._make_pg()
 
         # Explicit init
         for optimizer in [opt.Adam, opt.AdamW, opt.Adamax]:
             optim = optimizer(learning_rate=1e-2)
             optim.init(params)
-            self.assertTrue(
-                tree_equal(
-                    lambda p, s: mx.array_equal(s["v"], mx.zeros_like(p)),
-                    params,
-                    optim.state,
-                )
-            )
-            self.assertTrue(
-                tree_equal(
-                    lambda p, s: mx.array_equal(s["m"], mx.zeros_like(p)),
-                    params,
-                    optim.state,
-                )
+            self.assertTrue(_all_zero(params, optim.state, "v"))
+            self.assertTrue(_all_zero(params, optim.state, "m"))
+
+    def test_compiled_adamw_is_fused(self):
+        params, grads = self._make_pg()
+
+        def producers(**arrays):
+            # Map each named array to the primitive node computing it
+            s = StringIO()
+            mx.export_to_dot(s, **arrays)
+            nodes = {}
+            labels = {}
+            for line in s.getvalue().splitlines():
+                if "label" in line:
+                    labels[line.split()[1]] = line.split('"')[1]
+                elif " -> " in line and not line.startswith('"'):
+                    node, name = line.split(" -> ")
+                    nodes[name.strip('"')] = (node, labels[node])
+            return nodes
+
+        optim = opt.AdamW(learning_rate=1e-2)
+        optim.init(params)
+        mx.eval(optim.state)
+        update = optim.apply_gradients(grads, params)
+
+        compiled_optim = opt.AdamW(learning_rate=1e-2)
+        compiled_optim.init(params)
+        mx.eval(compiled_optim.state)
+        compiled_update = self._compiled_apply(compiled_optim, grads, params)
+
+        # Each parameter and its moments come out of a single fused primitive
+        arrays = {}
+        state = dict(tree_flatten(compiled_optim.state))
+        for i, (k, p) in enumerate(tree_flatten(compiled_update)):
+            arrays.update(
+                {f"p{i}": p, f"m{i}": state[k + ".m"], f"v{i}": state[k + ".v"]}
             )
+        nodes = producers(**arrays)
+        for i in range(len(arrays) // 3):
+            node, label = nodes[f"p{i}"]
+            self.assertTrue(label.startswith("Compiled"))
+            self.assertEqual(nodes[f"m{i}"][0], node)
+            self.assertEqual(nodes[f"v{i}"][0], node)
+        self.assertTrue(tree_equal(mx.allclose, update, compiled_update))
+
+    def test_compiled_adam_memory(self):
+        params = {"w": mx.zeros((2**20,))}
+        grads = {"w": mx.ones((2**20,))}
+        optim = opt.Adam(learning_rate=1e-2)
+        optim.init(params)
+        mx.eval(params, grads, optim.state)
+        param_bytes = params["w"].nbytes
+
+        mx.synchronize()
+        mx.reset_peak_memory()
+        active = mx.get_active_memory()
+        update = self._compiled_apply(optim, grads, params)
+        mx.eval(update, optim.state)
+        mx.synchronize()
+
+        # The fused update only allocates the new parameter and moments, the
+        # slack is for the scalars
+        bound = 3 * param_bytes + param_bytes // 16
+        self.assertLessEqual(mx.get_peak_memory() - active, bound)
+
+    _adamw_reference = None
+
+    @classmethod
+    def _get_adamw_reference(cls):
+        # Take the torch step on first use, on the device set up for the test
+        if cls._adamw_reference is not None:
+            return cls._adamw_reference
 
-    @unittest.skipIf(not has_torch, "requires Torch")
-    def test_adamw_matches_pytorch(self):
         mx.random.seed(0)
         np.random.seed(0)
 
         model = nn.Linear(3, 1)
-        init_weight = np.array(model.weight.tolist())
-        init_bias = np.array(model.bias.tolist())
-
-        def loss_fn(model, x, y):
-            pred = model(x)
-            return nn.losses.mse_loss(pred, y)
+        init_weight = np.array(model.weight)
+        init_bias = np.array(model.bias)
 
         x = np.random.rand(3, 3)
         y = np.random.rand(3, 1)
 
-        optimizer = opt.AdamW(learning_rate=3e-4, bias_correction=True)
-        loss_and_grad_fn = nn.value_and_grad(model, loss_fn)
-        loss, grads = loss_and_grad_fn(model, mx.array(x), mx.array(y))
-        optimizer.update(model, grads)
-
         # Equivalent torch code
         torch_model = torch.nn.Linear(3, 1)
 
@@ -231,33 +272,50 @@ class TestOptimizers(mlx_tests.MLXTestCase):
         loss.backward()
         torch_optimizer.step()
 
+        reference = {"init_weight": init_weight, "init_bias": init_bias, "x": x, "y": y}
         for name, param in torch_model.named_parameters():
+            reference[f"grad_{name}"] = param.grad.detach().numpy()
+            reference[f"param_{name}"] = param.data.detach().numpy()
+        cls._adamw_reference = reference
+        return reference
+
+    @unittest.skipIf(not has_torch, "requires Torch")
+    def test_adamw_matches_pytorch(self):
+        reference = self._get_adamw_reference()
+
+        model = nn.Linear(3, 1)
+        model.update(
+            {
+                "weight": mx.array(reference["init_weight"]),
+                "bias": mx.array(reference["init_bias"]),
+            }
+        )
+
+        def loss_fn(model, x, y):
+            pred = model(x)
+            return nn.losses.mse_loss(pred, y)
+
+        x = mx.array(reference["x"])
+        y = mx.array(reference["y"])
+        optimizer = opt.AdamW(learning_rate=3e-4, bias_correction=True)
+        loss_and_grad_fn = nn.value_and_grad(model, loss_fn)
+        loss, grads = loss_and_grad_fn(model, x, y)
+        optimizer.update(model, grads)
+
+        for name in ["weight", "bias"]:
             mlx_grad = np.array(grads[name])
-            torch_grad = param.grad.detach().numpy()
-            self.assertTrue(np.allclose(torch_grad, mlx_grad))
+            self.assertTrue(np.allclose(reference[f"grad_{name}"], mlx_grad))
 
-        for name, param in torch_model.named_parameters():
             mlx_param = np.array(model[name])
-            torch_param = param.data.detach().numpy()
-            self.assertTrue(np.allclose(torch_param, mlx_param))
+            self.assertTrue(np.allclose(reference[f"param_{name}"], mlx_param))
 
     def test_lion(self):
-        params = {
-            "first": [mx.zeros((10,)), mx.zeros((1,))],
-            "second": mx.zeros((1,)),
-        }
-        grads = tree_map(lambda x: mx.ones_like(x), params)
+        params, grads = self._make_pg()
 
         # Explicit init
         optim = opt.Lion(learning_rate=1e-2)
         optim.init(params)
-        self.assertTrue(
-            tree_equal(
-                lambda p, s: mx.array_equal(s["m"], mx.zeros_like(p)),
-                params,
-                optim.state,
-            )
-        )
+        self.assertTrue(_all_zero(params, optim.state, "m"))
 
     def test_adafactor(self):
         x = mx.zeros((5, 5))
@@ -298,7 +356,7 @@ class TestOptimizers(mlx_tests.MLXTestCase):
         uncompiled_params = model.parameters()
 
         # Pure version
-        def loss(params, x):
+        def pure_loss(params, x):
             model.update(params)
             return model(x).sum()
 
@@ -307,20 +365,16 @@ class TestOptimizers(mlx_tests.MLXTestCase):
 
         @mx.compile
         def step(params, opt_state, x):
-            grad = mx.grad(loss)(params, x)
+            grad = mx.grad(pure_loss)(params, x)
             optim.state = opt_state
             params = optim.apply_gradients(grad, params)
             return params, optim.state
 
         optim.init(model.parameters())
         pure_params, _ = step(model.parameters(), optim.state, x)
-        self.assertTrue(mx.allclose(pure_params["weight"], uncompiled_params["weight"]))
-        self.assertTrue(mx.allclose(pure_params["bias"], uncompiled_params["bias"]))
+        self.assertTrue(tree_equal(mx.allclose, pure_params, uncompiled_params))
 
         # Impure version
-        def loss(model, x):
-            return model(x).sum()
-
         model.update(orig_params)
         optim = opt.SGD(learning_rate=1e-2, momentum=0.9)
         state = [model.state, optim.state]
@@ -332,18 +386,19 @@ class TestOptimizers(mlx_tests.MLXTestCase):
 
         step(x)
         impure_params = model.parameters()
-        self.assertTrue(
-            mx.allclose(impure_params["weight"], uncompiled_params["weight"])
-        )
-        self.assertTrue(mx.allclose(impure_params["bias"], uncompiled_params["bias"]))
+        self.assertTrue(tree_equal(mx.allclose, impure_params, uncompiled_params))
 
     def test_update_lr_compiled(self):
         params = {"w": mx.ones((5, 5))}
         grads = tree_map(lambda x: mx.ones_like(x), params)
         optim = opt.SGD(-1.0)
+        optim.init(params)
+        num_traces = 0
 
-        @partial(mx.compile, inputs=optim.state)
+        @partial(mx.compile, inputs=optim.state, outputs=optim.state)
         def update(grads):
+            nonlocal num_traces
+            num_traces += 1
             return optim.apply_gradients(grads, params)
 
         result = update(grads)
@@ -351,21 +406,36 @@ class TestOptimizers(mlx_tests.MLXTestCase):
         optim.learning_rate = -2.0
         result = update(grads)
         self.assertTrue(mx.allclose(result["w"], mx.full((5, 5), 3.0)))
+        optim.learning_rate = mx.array(-3.0)
+        result = update(grads)
+        self.assertTrue(mx.allclose(result["w"], mx.full((5, 5), 4.0)))
+
+        # The learning rate is an array in the state so changing it does not
+        # recompile the update
+        self.assertEqual(num_traces, 1)
 
 
 class TestSchedulers(mlx_tests.MLXTestCase):
     def test_decay_lr(self):
-        for optim_class in optimizers_dict.values():
-            lr_schedule = opt.step_decay(1e-1, 0.9, 1)
-            optimizer = optim_class(learning_rate=lr_schedule)
-
-            params = {"w": mx.ones((5, 5))}
-            grads = tree_map(lambda x: mx.ones_like(x), params)
-
-            for it in range(10):
-                optimizer.apply_gradients(grads, params)
-                expected_lr = 0.1 * (0.9**it)
-                self.assertAlmostEqual(optimizer.learning_rate, expected_lr, delta=1e-7)
+        # The schedule and inputs are stateless so all optimizers share them
+        lr_schedule = opt.step_decay(1e-1, 0.9, 1)
+        params = {"w": mx.ones((5, 5))}
+        grads = tree_map(mx.ones_like, params)
+        for name, optim_class in optimizers_dict.items():
+            with self.subTest(optimizer=name):
+                optimizer = optim_class(learning_rate=lr_schedule)
+                optimizer.init(params)
+
+                @partial(mx.compile, inputs=optimizer.state, outputs=optimizer.state)
+                def step(grads, params):
+                    return optimizer.apply_gradients(grads, params)
+
+                for it in range(10):
+                    step(grads, params)
+                    expected_lr = 0.1 * (0.9**it)
+                    self.assertAlmostEqual(
+                        optimizer.learning_rate, expected_lr, delta=1e-7
+                    )
 
     def test_step_decay(self):
         lr_schedule = opt.step_decay(1e-1, 0.9, 1000)
@@ -392,6 +462,32 @@ class TestSchedulers(mlx_tests.MLXTestCase):
         lr = lr_schedule(20)
         self.assertEqual(lr, expected_end_lr)
 
+    def test_schedules_over_steps(self):
+        steps = np.arange(20)
+        decayed = 0.5 * (1.0 + np.cos(np.pi * np.minimum(steps, 10) / 10))
+        schedules = {
+            "exponential_decay": (
+                opt.exponential_decay(0.1, 0.9),
+                0.1 * 0.9**steps,
+            ),
+            "step_decay": (opt.step_decay(0.1, 0.9, 5), 0.1 * 0.9 ** (steps // 5)),
+            "cosine_decay": (
+                opt.cosine_decay(0.1, 10, 0.01),
+                0.01 + decayed * (0.1 - 0.01),
+            ),
+            "linear_schedule": (
+                opt.linear_schedule(0.0, 0.1, 10),
+                np.minimum(steps, 10) * 0.01,
+            ),
+        }
+
+        # Schedules are array functions so a compiled schedule can evaluate
+        # all the steps at once
+        for name, (schedule, expected) in schedules.items():
+            with self.subTest(schedule=name):
+                out = mx.compile(schedule)(mx.array(steps))
+                self.assertTrue(np.allclose(np.array(out), expected, atol=1e-7))
+
     def test_schedule_joiner(self):
         boundaries = [2, 3, 4]
         schedules = [lambda _: 3, lambda _: 4, lambda _: 5]
@@ -399,12 +495,10 @@ class TestSchedulers(mlx_tests.MLXTestCase):
             opt.schedulers.join_schedules(schedules, boundaries)
         boundaries = [2, 4]
         schedule = opt.schedulers.join_schedules(schedules, boundaries)
-        self.assertEqual(schedule(0).item(), 3)
-        self.assertEqual(schedule(1).item(), 3)
-        self.assertEqual(schedule(2).item(), 4)
-        self.assertEqual(schedule(3).item(), 4)
-        self.assertEqual(schedule(5).item(), 5)
-        self.assertEqual(schedule(7).item(), 5)
+        # The joined schedule is elementwise so all the steps go in at once
+        actual = schedule(mx.array([0, 1, 2, 3, 5, 7]))
+        expected = mx.array([3, 3, 4, 4, 5, 5])
+        self.assertTrue(mx.array_equal(actual, expected).item())
 
     def test_linear_warmup_with_cosine_decay(self):
         warmup_schedule = opt.schedulers.linear_schedule(0.0, 1e-5, 100)
@@ -431,9 +525,12 @@ class TestSchedulers(mlx_tests.MLXTestCase):
         def update():
             optimizer.update({}, {})
 
-        for step in range(5):
+        lrs = []
+        for _ in range(5):
             update()
-            self.assertAlmostEqual(lr_schedule(step), optimizer.learning_rate.item())
+            lrs.append(optimizer.learning_rate)
+        expected = mx.array([lr_schedule(step) for step in range(5)])
+        self.assertTrue(mx.allclose(mx.stack(lrs), expected, rtol=0, atol=1e-7).item())
 
     def test_clip_grad_norm(self):
         # Test with small gradients that do not require clipping
@@ -457,8 +554,8 @@ class TestSchedulers(mlx_tests.MLXTestCase):
         clipped_grads, total_norm = opt.clip_grad_norm(large_grads, max_norm)
         # Correctly extract only the gradient values for norm calculation
         clipped_values = [value for _, value in tree_flatten(clipped_grads)]
-        norm_of_clipped = mx.sqrt(
-            sum(mx.square(g).sum() for g in clipped_values)
+        norm_of_clipped = mx.linalg.norm(
+            mx.concatenate([g.flatten() for g in clipped_values])
         ).item()
         self.assertAlmostEqual(
             norm_of_clipped,
@@ -519,11 +616,12 @@ class TestSchedulers(mlx_tests.MLXTestCase):
 
         self.assertEqual(len(optimizer.state["states"]), 2)
 
-        adam_states = tree_flatten(optimizer.state["states"][0])
-        sgd_states = tree_flatten(optimizer.state["states"][1])
-        self.assertEqual((len(sgd_states) - 2) * 2, len(adam_states) - 2)
-        self.assertFalse(any("bias" in k for k, v in adam_states))
-        self.assertFalse(any("weight" in k for k, v in sgd_states))
+        adam_states, sgd_states = optimizer.state["states"]
+        adam_names = np.array([k for k, _ in tree_flatten(adam_states)])
+        sgd_names = np.array([k for k, _ in tree_flatten(sgd_states)])
+        self.assertEqual((len(sgd_names) - 2) * 2, len(adam_names) - 2)
+        self.assertFalse((np.char.find(adam_names, "bias") >= 0).any())
+        self.assertFalse((np.char.find(sgd_names, "weight") >= 0).any())
 
 
 if __name__ == "__main__":
@@ -168,6 +168,55 @@ TEST_CASE("test simplify noops") {
   set_compile_mode(CompileMode::enabled);
 }
 
+TEST_CASE("test simplify commutative") {
+  set_compile_mode(CompileMode::no_fuse);
+  auto fun = [](const std::vector<array>& inputs) -> std::vector<array> {
+    auto& a = inputs[0];
+    auto& b = inputs[1];
+    return {(a + b) * (b + a), (a - b) * (b - a)};
+  };
+  auto a = array({1.0f, 2.0f});
+  auto b = array({3.0f, 4.0f});
+  auto out = compile(fun)({a, b});
+  CHECK_EQ(out[0].inputs()[0].id(), out[0].inputs()[1].id());
+  CHECK(out[1].inputs()[0].id() != out[1].inputs()[1].id());
+  CHECK(array_equal(out[1], array({-4.0f, -4.0f})).item<bool>());
+  set_compile_mode(CompileMode::enabled);
+}
+
+TEST_CASE("test simplify identities") {
+  set_compile_mode(CompileMode::no_fuse);
+  auto fun = [](const std::vector<array>& inputs) -> std::vector<array> {
+    auto& a = inputs[0];
+    auto& b = inputs[1];
+    return {abs(a) * 1 + 0, exp(b) * 1.0f - 0.0f, exp(b) + 0.0f};
+  };
+  auto a = array({-1, 2});
+  auto b = array({0.0f, 1.0f});
+  auto out = compile(fun)({a, b});
+  CHECK_EQ(typeid(out[0].primitive()), typeid(Abs));
+  CHECK_EQ(typeid(out[1].primitive()), typeid(Exp));
+
+  // Adding zero is not an identity for floats (-0.0 + 0.0 is 0.0)
+  CHECK_EQ(typeid(out[2].primitive()), typeid(Add));
+  CHECK(array_equal(out[0], array({1, 2})).item<bool>());
+
+  // The broadcast scalars also take stop gradient inputs when shapeless
+  out = compile(fun, /* shapeless */ true)({a, b});
+  CHECK_EQ(typeid(out[0].primitive()), typeid(Abs));
+  CHECK_EQ(typeid(out[1].primitive()), typeid(Exp));
+  CHECK_EQ(out[1].inputs()[0].id(), b.id());
+
+  // Not an identity when the ones take their shape from another input
+  auto mul_ones = [](const std::vector<array>& inputs) -> std::vector<array> {
+    auto ones = broadcast_arrays({array(1.0f), inputs[1]})[0];
+    return {inputs[0] * ones};
+  };
+  out = compile(mul_ones, /* shapeless */ true)({ones({2, 3}), ones({2, 3})});
+  CHECK_EQ(typeid(out[0].primitive()), typeid(Multiply));
+  set_compile_mode(CompileMode::enabled);
+}
+
 auto add_diff(const std::vector<array>& inputs) {
   auto a = inputs[0];
   return std::vector<array>{cos(a) + sin(a)};
@@ -635,8 +684,9 @@ TEST_CASE("test transform compiled function") {
   auto& p = outs[0].primitive();
   CHECK_EQ(typeid(p), typeid(Compiled));
   CHECK_EQ(outs[0].siblings()[0].id(), outs[1].id());
+  // Multiplying by the cotangent of ones is simplified away
+  CHECK_EQ(outs[0].inputs().size(), 1);
   CHECK(!outs[0].inputs()[0].has_primitive());
-  CHECK(!outs[0].inputs()[1].has_primitive());
 }
 
 TEST_CASE("test fusion kernel reuse") {
@@ -804,3 +854,25 @@ TEST_CASE("test compile with no-ops") {
   auto out = compile(fun)({in})[0];
   CHECK_EQ(out.inputs()[0].id(), in.id());
 }
+
+TEST_CASE("test eval in compiled") {
+  auto fun = [](const array& x) {
+    auto y = exp(abs(x));
+    eval(y);
+    return sum(y);
+  };
+  auto x = array({2.0f, -1.0f, 0.5f});
+  auto expected = fun(x);
+  auto out = compile([&fun](const std::vector<array>& inputs) {
+    return std::vector<array>{fun(inputs[0])};
+  })({x})[0];
+  CHECK(allclose(out, expected).item<bool>());
+
+  // The inputs of the gradient are still placeholders of the compiled
+  // function
+  expected = grad(fun)(x);
+  out = compile([&fun](const std::vector<array>& inputs) {
+    return std::vector<array>{grad(fun)(inputs[0])};
+  })({x})[0];
+  CHECK(allclose(out, expected).item<bool>());
+}